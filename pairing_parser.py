@@ -1,39 +1,104 @@
 #!/usr/bin/env python3
 import re
 import json
+import hashlib
+import copy
+import pickle
 import sys
 import os
-import math
-from datetime import datetime, timedelta
+import mmap
+import stat
+import functools
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime
+
+try:
+    import orjson  # C serializer used by main() for the final dump
+except ImportError:
+    orjson = None
 
 # ---------------- Constants & precompiled regex ----------------
 CURRENT_YEAR = datetime.now().year
 MONTH_MAP = {'JAN':1,'FEB':2,'MAR':3,'APR':4,'MAY':5,'JUN':6,'JUL':7,'AUG':8,'SEP':9,'OCT':10,'NOV':11,'DEC':12}
-
-TRIP_SPLIT = re.compile(r'(?=\bTRIP\s*#)', re.I)
+# Month tokens are captured under re.I, so also key every letter-case spelling
+# ('Jul', 'jUL', ...) and look them up without .upper()
+MONTH_MAP.update({
+    ''.join(spelling): num
+    for mon, num in list(MONTH_MAP.items())
+    for spelling in itertools.product(*((c, c.lower()) for c in mon))
+})
+# C-locale %a / %b names, indexed by date.weekday() and date.month, for calendar cells
+WEEKDAY_ABBR = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+MONTH_ABBR = (None, 'Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+# Start of every trip block; parse_full_text slices the text between these offsets
+TRIP_START = re.compile(r'\bTRIP\s*#', re.I)
 TRIP_HEAD = re.compile(r"TRIP\s*#\s*(\S+)\s+(\S+).*?\b([A-Z]{3})\b", re.I)
 TRIP_HEAD_NOBASE = re.compile(r"TRIP\s*#\s*(\S+)\s+(\S+)", re.I)
 
+# Deadhead flight-number prefixes; LIM9 is the one longer prefix, checked on its own
+DH_PREFIXES = frozenset({"DH", "AC", "UA", "AV", "VB", "AA"})
+
 TAFB_RE = re.compile(r"TAFB:\s*([\d+h\(\)\w:]+)", re.I)
 CREDIT_RE = re.compile(r"Credit Time:\s*([^\s,]+)", re.I)
 PERDIEM_RE = re.compile(r"PERDIEM:\s*([\d\.,]+)", re.I)
+RPT_RE = re.compile(r'RPT.*?(\d{2}:\d{2})')
+RLS_RE = re.compile(r'RLS.*?(\d{2}:\d{2})')
+# Fields parse_trip_block reads from their first occurrence only, one search each
+FIRST_FIELDS = (
+    ('tafb', TAFB_RE),
+    ('credit', CREDIT_RE),
+    ('perdiem', PERDIEM_RE),
+    ('rpt', RPT_RE),
+    ('rls', RLS_RE),
+)
 
+# Flight numbers and stations are upper case in pairing files, so legs match
+# case-sensitively and need no .upper() afterwards.
 LEG_PATTERN = re.compile(
-    r"\s+(\d{1,2})\s+([A-Z0-9_]{2,9})\s+([A-Z]{3})\s+([A-Z]{3})\s+(\d{2}:\d{2})\s+(\d{2}:\d{2})\s+([0-9]{1,3}h[0-9]{2}|[0-9]{1,2}:\d{2})",
-    re.I,
+    r"\s+(\d{1,2})\s+([A-Z0-9_]{2,9})\s+([A-Z]{3})\s+([A-Z]{3})\s+(\d{2}:\d{2})\s+(\d{2}:\d{2})\s+([0-9]{1,3}[hH][0-9]{2}|[0-9]{1,2}:\d{2})",
 )
+# Necessary prefix of a leg: the whitespace right before a day number and flight.
+# LEG_PATTERN.match() at an anchor's start confirms the leg.
+LEG_ANCHOR_SRC = r'\s\d{1,2}\s+[A-Z0-9_]{2,9}\s'
+LEG_ANCHOR = re.compile(LEG_ANCHOR_SRC)
 
-LAYOVER_MARKER = re.compile(r"----\s+([A-Z]{3})\b", re.I)
 LAYOVER_CUE = re.compile(r"\b(hotel|overnight|layover)\b", re.I)
+
+# The repeating per-trip tokens fused into one alternation so parse_trip_block collects
+# them in a single walk of the block. Legs stay case-sensitive.
+# 'leg' is only LEG_ANCHOR, confirmed with LEG_PATTERN.match(), so prose lines never
+# run the full seven-group pattern and whitespace runs are not backtracked over.
+# 'cue' marks a layover word; the scan widens it to its line.
+# FIRST_FIELDS stay out: re-matching a repeated label at every occurrence would rerun
+# its value tail each time, which is quadratic in the number of repeats.
+TRIP_TOKENS = re.compile("|".join(f"(?P<{name}>{pat})" for name, pat in (
+    ('leg', f'(?-i:{LEG_ANCHOR_SRC})'),
+    ('cue', LAYOVER_CUE.pattern),
+)), re.I)
+
+LAYOVER_MARKER = re.compile(r"----\s+([A-Z]{3})\b", re.I)
 LAYOVER_DUR = re.compile(r"(\d{1,3}h\d{2})", re.I)
+# Cue lines without a ---- marker: first upper-case three-letter word is the station
+LAYOVER_APT = re.compile(r"\b([A-Z]{3})\b")
+# A layover cue is widened to its whole line; "line" means what str.splitlines()
+# yields, so the boundaries are every character splitlines() breaks on, not just \n.
+LINE_BREAK = re.compile(r'[\n\r\v\f\x1c-\x1e\x85\u2028\u2029]')
 
 EFFECTIVE_NEIGHBOR = re.compile(r'([A-Z]{3})\s+(\d{1,2})\s*-\s*([A-Z]{3})\s+(\d{1,2})', re.I)
+MASK_BITS = re.compile(r'[01]')  # the 0/1 day flags inside a [...] weekday mask
 BRACKET_MASK = re.compile(r'\[([^\]]+)\]')
 BASE_MASK = re.compile(r'\b[A-Z]{3}:\s*([0-9_]{1,7})')
 NEAR_MASK = re.compile(r'([0-9_]{1,7})\s+effective', re.I)
 EXCEPTIONS_RE = re.compile(r'except\s+(.*)', re.I)
 MO_DAY = re.compile(r'([A-Z]{3})\s+(\d{1,2})', re.I)
-TIME_PAIR = re.compile(r'(\d{2}):(\d{2})')
+
+# time_str_to_minutes() patterns
+TIME_PAREN = re.compile(r'\([^)]*\)')
+TIME_H_MIN = re.compile(r'(\d+)\s*h\s*(\d{1,2})?', re.I)
+TIME_HMM = re.compile(r'^\d{1,3}h\d{2}$', re.I)
 
 # --- UPDATED PRELIM REGEX ---
 # Relaxed the anchor to catch prelim headers even with messy whitespace or missing brackets
@@ -42,18 +107,28 @@ PRELIM_SPLIT = re.compile(
     re.M | re.I
 )
 PRELIM_TRIP_HEAD = re.compile(r"TRIP\s*#\s*(\S+)\s+(\S+)", re.I)
+PRELIM_BASE_MASK = re.compile(r'\b([A-Z]{3}):\s*([0-9_]{1,7})')
+PRELIM_CITY = re.compile(r'^\s*([A-Z]{3})')
+PRELIM_EFFECTIVE = re.compile(r'(effective.*)$', re.I)
 
 # ---------------- Helper functions ----------------
 
 def time_str_to_minutes(time_str):
     if not time_str or not isinstance(time_str, str):
         raise ValueError("Invalid time string input")
-    s = re.sub(r'\([^)]*\)', '', time_str).strip()
-    m = re.match(r'(\d+)\s*h\s*(\d{1,2})?', s, re.I)
+    return _time_str_to_minutes(time_str)
+
+
+# A file holds a few hundred distinct time strings but parses them thousands of
+# times. Failures raise and so are simply not cached.
+@functools.lru_cache(maxsize=4096)
+def _time_str_to_minutes(time_str):
+    s = TIME_PAREN.sub('', time_str).strip()
+    m = TIME_H_MIN.match(s)
     if m:
         hours = int(m.group(1)); minutes = int(m.group(2) or 0)
         return hours * 60 + minutes
-    if re.match(r'^\d{1,3}h\d{2}$', s, re.I):
+    if TIME_HMM.match(s):
         h, m = s.lower().split('h'); return int(h)*60 + int(m)
     if ":" in s:
         parts = s.split(":")
@@ -64,6 +139,29 @@ def time_str_to_minutes(time_str):
     raise ValueError(f"Could not parse time string: {time_str}")
 
 
+def _has_leg(text):
+    """bool(LEG_PATTERN.search(text)), but only running LEG_PATTERN at LEG_ANCHOR hits."""
+    pos = 0
+    while True:
+        a = LEG_ANCHOR.search(text, pos)
+        if not a:
+            return False
+        if LEG_PATTERN.match(text, a.start()):
+            return True
+        pos = a.start() + 1
+
+
+def _is_redeye(leg_times):
+    """True if any (dep, arr) minutes pair includes 02:00 (wrapping past midnight)."""
+    for dep_m, arr_m in leg_times:
+        if dep_m <= arr_m:
+            if dep_m <= 120 <= arr_m:
+                return True
+        elif arr_m >= 120 or dep_m <= 120:
+            return True
+    return False
+
+
 def minutes_to_time_str(total_minutes):
     try:
         h = int(total_minutes // 60); m = int(total_minutes % 60)
@@ -73,7 +171,7 @@ def minutes_to_time_str(total_minutes):
 
 
 def _parse_bracket_mask(mask):
-    nums = re.findall(r'[01]', mask)
+    nums = MASK_BITS.findall(mask)
     if len(nums) < 7:
         return None
     weekdays = {(i % 7) for i, ch in enumerate(nums[:7]) if ch == '1'}
@@ -92,10 +190,10 @@ def determine_effective_year(block):
     
     if first_date_match:
         mo, day = first_date_match.groups()
-        mo_num = MONTH_MAP.get(mo.upper())
+        mo_num = MONTH_MAP.get(mo)
         day_num = int(day)
         
-        if mo.upper() == 'JAN' and current_date.month == MONTH_MAP['DEC']:
+        if mo_num == MONTH_MAP['JAN'] and current_date.month == MONTH_MAP['DEC']:
             return CURRENT_YEAR + 1
         
         try:
@@ -109,15 +207,17 @@ def determine_effective_year(block):
 
 
 def parse_operating_dates(block, effective_year):
+    """Return the trip's start dates as datetime.date objects, in order."""
     eff_idx = block.lower().find('effective')
     if eff_idx == -1:
         return []
-    window = block[max(0, eff_idx - 200): eff_idx + 200]
+    # Search the +/-200 char window around 'effective' in place via pos/endpos
+    lo, hi = max(0, eff_idx - 200), min(len(block), eff_idx + 200)
 
-    m = EFFECTIVE_NEIGHBOR.search(window)
+    m = EFFECTIVE_NEIGHBOR.search(block, lo, hi)
     if not m:
         return []
-    start_mon, start_day, end_mon, end_day = m.group(1).upper(), m.group(2), m.group(3).upper(), m.group(4)
+    start_mon, start_day, end_mon, end_day = m.groups()
     try:
         start_date = datetime(effective_year, MONTH_MAP[start_mon], int(start_day)).date()
         end_date = datetime(effective_year, MONTH_MAP[end_mon], int(end_day)).date()
@@ -128,17 +228,17 @@ def parse_operating_dates(block, effective_year):
         return []
 
     mask_weekdays = None
-    bracket = BRACKET_MASK.search(window)
+    bracket = BRACKET_MASK.search(block, lo, hi)
     if bracket:
         mask_weekdays = _parse_bracket_mask(bracket.group(1))
 
     if mask_weekdays is None:
-        mbase = BASE_MASK.search(window)
+        mbase = BASE_MASK.search(block, lo, hi)
         if mbase:
             mask_weekdays = _parse_underscore_digit_mask(mbase.group(1))
 
     if mask_weekdays is None:
-        mnear = NEAR_MASK.search(window)
+        mnear = NEAR_MASK.search(block, lo, hi)
         if mnear:
             mask_weekdays = _parse_underscore_digit_mask(mnear.group(1))
 
@@ -146,27 +246,38 @@ def parse_operating_dates(block, effective_year):
         mask_weekdays = set(range(7))
 
     exceptions = set()
-    ex_match = EXCEPTIONS_RE.search(window)
+    ex_match = EXCEPTIONS_RE.search(block, lo, hi)
     if ex_match:
-        ex_str = ex_match.group(1)
-        for mo, d in MO_DAY.findall(ex_str):
+        for ex_m in MO_DAY.finditer(block, ex_match.start(1), ex_match.end(1)):
+            mo, d = ex_m.groups()
             try:
-                ex_date = datetime(effective_year, MONTH_MAP[mo.upper()], int(d)).date()
+                ex_date = datetime(effective_year, MONTH_MAP[mo], int(d)).date()
                 if start_date <= ex_date <= end_date:
                     exceptions.add(ex_date)
-                ex_date_next = datetime(effective_year + 1, MONTH_MAP[mo.upper()], int(d)).date()
+                ex_date_next = datetime(effective_year + 1, MONTH_MAP[mo], int(d)).date()
                 if start_date <= ex_date_next <= end_date:
                     exceptions.add(ex_date_next)
             except Exception:
                 continue
 
-    res = []
-    cur = start_date
-    while cur <= end_date:
-        if cur.weekday() in mask_weekdays and cur not in exceptions:
-            res.append(cur.strftime('%Y-%m-%d'))
-        cur += timedelta(days=1)
-    return res
+    return list(_expand_dates(start_date, end_date, frozenset(mask_weekdays), frozenset(exceptions)))
+
+
+# Trips in one file share a handful of windows/masks, so the expansion is memoised
+@functools.lru_cache(maxsize=1024)
+def _expand_dates(start_date, end_date, mask_weekdays, exceptions):
+    """Dates in [start_date, end_date] on a mask weekday and not an exception, as a tuple."""
+    # Work in ordinals; ordinal 1 (0001-01-01) is a Monday, so (o - 1) % 7 is
+    # date.weekday(). Each mask weekday is a stride-7 range from its first
+    # occurrence, so only operating days are visited and materialised.
+    exc_ords = {d.toordinal() for d in exceptions}
+    start_ord = start_date.toordinal(); end_ord = end_date.toordinal()
+    ords = []
+    for wd in mask_weekdays:
+        first_o = start_ord + (wd - (start_ord - 1)) % 7
+        ords.extend(range(first_o, end_ord + 1, 7))
+    ords.sort()
+    return tuple(date.fromordinal(o) for o in ords if o not in exc_ords)
 
 # ---------------- Main parsing ----------------
 
@@ -185,231 +296,214 @@ def parse_trip_block(block):
     trip['original_text'] = block
     effective_year = determine_effective_year(block)
     trip['effective_year'] = effective_year
-    trip['operating_dates'] = parse_operating_dates(block, effective_year)
+    operating_dates = parse_operating_dates(block, effective_year)  # date objects
+    trip['operating_dates'] = [d.isoformat() for d in operating_dates]
+
+    first = {}
+    for kind, pattern in FIRST_FIELDS:
+        fm = pattern.search(block)
+        if fm:
+            first[kind] = fm.group(1)
+
+    # Single pass over the block: legs and layover-cue lines are collected in order.
+    # Only a leg consumes text; after a cue or a failed anchor the scan resumes one
+    # character on, so overlapping tokens are still seen.
+    days = {}
+    leg_times = []  # (dep, arr) minutes of every leg in scan order, for the redeye check
+    deadhead_legs = []
+    layover_lines = []  # lines carrying a layover cue, in block order
+    cue_line_end = 0  # end of the last recorded cue line; cues before it are on it
+    pos = 0
+    while True:
+        tm = TRIP_TOKENS.search(block, pos)
+        if not tm:
+            break
+        kind = tm.lastgroup
+        if kind == 'cue':
+            # Widen to the enclosing line, once per line however many cues it holds.
+            # The scan still resumes inside the line: it can hold a leg.
+            if tm.start() >= cue_line_end:
+                # The line starts after the previous cue line, so look back no further
+                ls = block.rfind('\n', cue_line_end, tm.start()) + 1 or cue_line_end
+                for br in LINE_BREAK.finditer(block, ls, tm.start()):
+                    ls = br.end()
+                le = LINE_BREAK.search(block, tm.end())
+                cue_line_end = le.start() if le else len(block)
+                layover_lines.append(block[ls:cue_line_end].rstrip())
+            pos = tm.start() + 1
+            continue
+        lm = LEG_PATTERN.match(block, tm.start())
+        if lm is None:
+            pos = tm.start() + 1
+            continue
+        pos = lm.end()
+
+        current_day, flight_num, dep, arr, dep_t, arr_t, blk = lm.groups()
+        is_deadhead = flight_num[:2] in DH_PREFIXES or flight_num.startswith("LIM9")
+        
+        # Set display number to 000DH for all deadheads, including LIM9
+        display_flight_num = "000DH" if is_deadhead else flight_num
+            
+        leg_data = {
+            "flight_number": display_flight_num,
+            "original_flight_number": flight_num, # Added to keep track of the LIM9 identifier
+            "dep_station": dep,
+            "arr_station": arr,
+            "dep_time": dep_t,
+            "arr_time": arr_t,
+            "duration": blk,
+            "is_deadhead": is_deadhead
+        }
+        days.setdefault(int(current_day), []).append(leg_data)
+        # LEG_PATTERN only captures HH:MM, so slice instead of re-matching
+        leg_times.append((int(dep_t[:2])*60 + int(dep_t[3:5]), int(arr_t[:2])*60 + int(arr_t[3:5])))
+
+        if is_deadhead:
+            leg_string = f"{display_flight_num}    {dep} {arr} {dep_t} {arr_t}  {blk}"
+            deadhead_legs.append(leg_string)
 
     # TAFB
-    tafb_m = TAFB_RE.search(block)
-    if tafb_m: 
-        trip['tafb'] = tafb_m.group(1).strip()
+    tafb = first.get('tafb')
+    if tafb: 
+        trip['tafb'] = tafb.strip()
         try:
             trip['tafb_minutes'] = time_str_to_minutes(trip['tafb'])
         except Exception:
             pass
 
     # Credit
-    credit_m = CREDIT_RE.search(block)
+    credit = first.get('credit')
+    credit_minutes = None
     trip['correctedcredit'] = 0.0
     trip['credit_time_per_day'] = 0.0
-    if credit_m: 
-        trip['credit_time'] = credit_m.group(1).strip()
+    if credit: 
+        trip['credit_time'] = credit.strip()
         try:
-            total_minutes = time_str_to_minutes(trip['credit_time'])
-            trip['credit_minutes'] = total_minutes
-            trip['correctedcredit'] = round(total_minutes / 60.0, 2)
+            credit_minutes = time_str_to_minutes(trip['credit_time'])
+            trip['credit_minutes'] = credit_minutes
+            trip['correctedcredit'] = round(credit_minutes / 60.0, 2)
         except Exception:
             pass
 
     # Per Diem
-    per_m = PERDIEM_RE.search(block)
+    per_diem = first.get('perdiem')
     trip['correctedperdiem'] = 0.0
-    if per_m:
+    if per_diem:
         try: 
-            per_diem_val = float(per_m.group(1).replace(',', ''))
+            per_diem_val = float(per_diem.replace(',', ''))
             trip['per_diem'] = per_diem_val
-            trip['correctedperdiem'] = math.ceil(per_diem_val / 2.0)
+            trip['correctedperdiem'] = int(-(-per_diem_val // 2))  # ceil(per_diem / 2)
         except Exception: 
-            trip['per_diem'] = per_m.group(1).strip()
-
-    trip['days'] = {}
-    trip['layovers'] = []
-    trip['has_deadhead'] = False
-    trip['deadhead_legs'] = []
-
-    for lm in LEG_PATTERN.finditer(block):
-        current_day = lm.group(1)
-        flight_num = lm.group(2).upper()
-        dep = lm.group(3).upper(); arr = lm.group(4).upper()
-        dep_t = lm.group(5); arr_t = lm.group(6); blk = lm.group(7)
-        
-        # Define all deadhead prefixes in a clean tuple
-        dh_prefixes = ("DH", "AC", "UA", "LIM9", "AV", "VB", "AA")
-        is_deadhead = flight_num.startswith(dh_prefixes)
-        
-        # Set display number to 000DH for all deadheads, including LIM9
-        display_flight_num = "000DH" if is_deadhead else flight_num
-            
-        leg_data = {
-            "flight_number": display_flight_num,
-            "original_flight_number": flight_num, # Added to keep track of the LIM9 identifier
-            "dep_station": dep,
-            "arr_station": arr,
-            "dep_time": dep_t,
-            "arr_time": arr_t,
-            "duration": blk,
-            "is_deadhead": is_deadhead
-        }
-        trip['days'].setdefault(current_day, []).append(leg_data)
+            trip['per_diem'] = per_diem.strip()
 
-        if is_deadhead:
-            trip['has_deadhead'] = True
-            leg_string = f"{display_flight_num}    {dep} {arr} {dep_t} {arr_t}  {blk}"
-            trip['deadhead_legs'].append(leg_string)
+    trip['days'] = days  # keyed by int day number
+    # Day numbers are at most two digits, so the extremes are all that is needed;
+    # the calendar walks range(min_day, max_day + 1) instead of sorting the keys.
+    min_day = min(days, default=0)
+    max_day = max(days, default=0)
+    layovers = trip['layovers'] = []
+    trip['has_deadhead'] = bool(deadhead_legs)
+    trip['deadhead_legs'] = deadhead_legs
 
     trip['starts_or_ends_with_deadhead'] = False
     trip['starts_with_deadhead_to_ylw'] = False
-    try:
-        if trip['days']:
-            sorted_days = sorted(int(k) for k in trip['days'].keys())
-            if sorted_days:
-                first_day_key = str(sorted_days[0])
-                first_day_legs = trip['days'].get(first_day_key, [])
-                if first_day_legs:
-                    first_leg_obj = first_day_legs[0]
-                    if isinstance(first_leg_obj, dict) and first_leg_obj.get('is_deadhead'):
-                        trip['starts_or_ends_with_deadhead'] = True
-                        if first_leg_obj.get('arr_station', '').upper() == 'YLW':
-                            trip['starts_with_deadhead_to_ylw'] = True
-
-                if not trip['starts_or_ends_with_deadhead']:
-                    last_day_key = str(sorted_days[-1])
-                    last_day_legs = trip['days'].get(last_day_key, [])
-                    if last_day_legs:
-                        last_leg_obj = last_day_legs[-1]
-                        if isinstance(last_leg_obj, dict) and last_leg_obj.get('is_deadhead'):
-                            trip['starts_or_ends_with_deadhead'] = True
-    except Exception:
-        pass
-
-    for raw in block.splitlines():
-        line = raw.rstrip()
+    if days:
+        first_leg = days[min_day][0]
+        last_leg = days[max_day][-1]
+        if first_leg['is_deadhead']:
+            trip['starts_or_ends_with_deadhead'] = True
+            trip['starts_with_deadhead_to_ylw'] = first_leg['arr_station'] == 'YLW'
+        elif last_leg['is_deadhead']:
+            trip['starts_or_ends_with_deadhead'] = True
+
+    # Only lines carrying a layover cue matter; the token scan collected those
+    for line in layover_lines:
         lmkr = LAYOVER_MARKER.search(line)
-        if lmkr and LAYOVER_CUE.search(line):
+        if lmkr:
             apt = lmkr.group(1).upper()
             dmatch = LAYOVER_DUR.search(line)
-            trip['layovers'].append({"location": apt, "duration": dmatch.group(1) if dmatch else "N/A"})
+            layover = {"location": apt, "duration": dmatch.group(1) if dmatch else "N/A"}
+            if dmatch:
+                try:
+                    layover["duration_minutes"] = time_str_to_minutes(dmatch.group(1))
+                except Exception:
+                    pass
+            layovers.append(layover)
         else:
-            if LAYOVER_CUE.search(line):
-                apt_alt = re.search(r'\b([A-Z]{3})\b', line)
-                if apt_alt:
-                    apt = apt_alt.group(1).upper()
-                    dmatch = LAYOVER_DUR.search(line)
-                    if dmatch:
-                        try:
-                            mins = time_str_to_minutes(dmatch.group(1))
-                            if mins >= 8*60:
-                                trip['layovers'].append({"location": apt, "duration": dmatch.group(1)})
-                        except Exception:
-                            trip['layovers'].append({"location": apt, "duration": dmatch.group(1)})
-                    else:
-                        trip['layovers'].append({"location": apt, "duration": "N/A"})
+            apt_alt = LAYOVER_APT.search(line)
+            if apt_alt:
+                apt = apt_alt.group(1)
+                dmatch = LAYOVER_DUR.search(line)
+                if dmatch:
+                    try:
+                        mins = time_str_to_minutes(dmatch.group(1))
+                        if mins >= 8*60:
+                            layovers.append({"location": apt, "duration": dmatch.group(1), "duration_minutes": mins})
+                    except Exception:
+                        layovers.append({"location": apt, "duration": dmatch.group(1)})
+                else:
+                    layovers.append({"location": apt, "duration": "N/A"})
 
     trip['longest_layover'] = 0.0
-    try:
-        longest = 0
-        for lay in trip.get('layovers', []):
-            dur = lay.get('duration', '')
-            try:
-                mins = time_str_to_minutes(dur)
-                if mins > longest: longest = mins
-            except Exception: continue
-        if longest > 0:
-            trip['longest_layover'] = round(longest / 60.0, 2)
-    except Exception:
-        trip['longest_layover'] = 0.0
+    longest = max((lay['duration_minutes'] for lay in layovers if lay.get('duration_minutes')), default=0)
+    if longest > 0:
+        trip['longest_layover'] = round(longest / 60.0, 2)
 
-    if trip['days']:
-        try:
-            keys = sorted(int(k) for k in trip['days'].keys())
-            trip['days_of_work'] = keys[-1] if keys else 0
-        except Exception:
-            trip['days_of_work'] = len(trip['days'])
-    else:
-        trip['days_of_work'] = 0
+    trip['days_of_work'] = max_day
         
-    if 'credit_minutes' in trip and trip.get('days_of_work', 0) > 0:
+    if credit_minutes is not None and max_day > 0:
         try:
-            avg_hours_decimal = (trip['credit_minutes'] / trip['days_of_work']) / 60.0
+            avg_hours_decimal = (credit_minutes / max_day) / 60.0
             trip['credit_time_per_day'] = round(avg_hours_decimal, 2)
         except Exception:
             trip['credit_time_per_day'] = 0.0
 
-    trip['calendar'] = []
-    current_effective_year = trip.get('effective_year', CURRENT_YEAR) 
-    if trip.get('operating_dates') and trip.get('days'):
+    calendar = trip['calendar'] = []
+    calendar_weekdays = []  # weekday() of every calendar cell, one list per instance
+    if operating_dates and days:
         try:
-            sorted_days = sorted(int(k) for k in trip['days'].keys())
-            for start_date_str in trip['operating_dates']:
+            for start_date in operating_dates:
                 try:
-                    start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
                     instance_calendar = {}
-                    for day_num in sorted_days:
-                        current_date = start_date + timedelta(days=day_num - 1)
-                        instance_calendar[str(day_num)] = current_date.strftime('%a %d %b')
-                    trip['calendar'].append(instance_calendar)
+                    instance_weekdays = []
+                    base_ord = start_date.toordinal() - 1  # ordinal of "day 0"
+                    for day_num in range(min_day, max_day + 1):
+                        if day_num not in days:
+                            continue
+                        current_date = date.fromordinal(base_ord + day_num)
+                        wd = current_date.weekday()
+                        instance_calendar[str(day_num)] = (
+                            f"{WEEKDAY_ABBR[wd]} {current_date.day:02d} {MONTH_ABBR[current_date.month]}"
+                        )
+                        instance_weekdays.append(wd)
+                    calendar.append(instance_calendar)
+                    calendar_weekdays.append(instance_weekdays)
                 except Exception:
                     continue
         except Exception:
             pass
 
-    trip['is_redeye'] = False
-    try:
-        if trip.get('days_of_work', 0) > 1 and len(trip.get('layovers', [])) >= 1:
-            for legs in trip['days'].values():
-                for leg in legs:
-                    if isinstance(leg, dict):
-                        dep_t_str = leg.get('dep_time', '')
-                        arr_t_str = leg.get('arr_time', '')
-                        dep_m_match = TIME_PAIR.match(dep_t_str)
-                        arr_m_match = TIME_PAIR.match(arr_t_str)
-                        if dep_m_match and arr_m_match:
-                            dep_m = int(dep_m_match.group(1))*60 + int(dep_m_match.group(2))
-                            arr_m = int(arr_m_match.group(1))*60 + int(arr_m_match.group(2))
-                            includes_0200 = False
-                            if dep_m <= arr_m:
-                                includes_0200 = (dep_m <= 120 <= arr_m)
-                            else:
-                                includes_0200 = (arr_m >= 120 or dep_m <= 120)
-                            if includes_0200:
-                                trip['is_redeye'] = True
-                                raise StopIteration
-    except StopIteration: pass
-    except Exception: trip['is_redeye'] = False
-
-    trip['is_lazy_pairing'] = False
-    try:
-        if trip['days_of_work'] > 1:
-            trip['is_lazy_pairing'] = all(len(d) <= 1 for d in trip['days'].values())
-    except Exception: pass
+    trip['is_redeye'] = max_day > 1 and bool(layovers) and _is_redeye(leg_times)
 
-    trip['is_weekday_only'] = True
-    try:
-        if not trip.get('calendar'):
-            trip['is_weekday_only'] = False
-        else:
-            for instance in trip.get('calendar', []):
-                for date_str in instance.values():
-                    date_obj = datetime.strptime(f"{date_str} {current_effective_year}", '%a %d %b %Y').date()
-                    if date_obj.weekday() >= 5:
-                        trip['is_weekday_only'] = False
-                        raise StopIteration
-    except StopIteration: pass
-    except Exception: trip['is_weekday_only'] = False
+    trip['is_lazy_pairing'] = max_day > 1 and all(len(d) <= 1 for d in days.values())
+
+    trip['is_weekday_only'] = bool(calendar_weekdays) and all(
+        wd < 5 for instance in calendar_weekdays for wd in instance
+    )
 
     trip['is_commutable'] = False
     try:
-        d = trip.get('days_of_work', 0)
-        rpt = re.search(r'RPT.*?(\d{2}:\d{2})', block)
-        rls = re.search(r'RLS.*?(\d{2}:\d{2})', block)
+        rpt = first.get('rpt')
+        rls = first.get('rls')
+        rpt_m = rls_m = None
         if rpt: 
-            trip['report_time'] = rpt.group(1)
-            trip['report_minutes'] = time_str_to_minutes(trip['report_time'])
+            trip['report_time'] = rpt
+            trip['report_minutes'] = rpt_m = int(rpt[:2])*60 + int(rpt[3:5])
         if rls: 
-            trip['release_time'] = rls.group(1)
-            trip['release_minutes'] = time_str_to_minutes(trip['release_time'])
+            trip['release_time'] = rls
+            trip['release_minutes'] = rls_m = int(rls[:2])*60 + int(rls[3:5])
             
-        if d in (3,4,5) and 'report_minutes' in trip and 'release_minutes' in trip:
-            rpt_m = trip['report_minutes']
-            rls_m = trip['release_minutes']
+        if max_day in (3,4,5) and rpt_m is not None and rls_m is not None:
             trip['is_commutable'] = (rpt_m > 11*60 and rls_m < (22*60+30))
     except Exception: pass
 
@@ -435,13 +529,13 @@ def parse_prelim_block(block):
     base_mask = "_______"
     
     # Try to find "YEG: 111____" pattern
-    m_base_mask = re.search(r'\b([A-Z]{3}):\s*([0-9_]{1,7})', head)
+    m_base_mask = PRELIM_BASE_MASK.search(head)
     if m_base_mask:
         base_code = m_base_mask.group(1).upper()
         base_mask = m_base_mask.group(2)
     else:
         # Fallback: look for 3-letter city code at start of line
-        m_city = re.match(r'^\s*([A-Z]{3})', head)
+        m_city = PRELIM_CITY.match(head)
         if m_city:
             base_code = m_city.group(1).upper()
 
@@ -451,13 +545,14 @@ def parse_prelim_block(block):
         fake_pairing = m_real_trip_head.group(2)
         is_prelim_type = False
     else:
-        # Generate dummy ID for true prelims
+        # Generate dummy ID for true prelims (sha1, so it is stable across runs
+        # unlike the PYTHONHASHSEED-salted hash())
         fake_trip = base_code
-        fake_pairing = f"P{hash(block) % 1000000:06d}" 
+        fake_pairing = "P" + hashlib.sha1(block.encode('ascii', 'ignore')).hexdigest()[:6].upper()
         is_prelim_type = True
 
     # 4. Extract effective clause
-    m_eff = re.search(r'(effective.*)$', head, re.I)
+    m_eff = PRELIM_EFFECTIVE.search(head)
     effective_clause = m_eff.group(1) if m_eff else "effective AUTO"
 
     # 5. Reconstruct a "Final" style header so the main parser can digest it
@@ -485,40 +580,140 @@ def strip_cover_pages(text):
     return text[idx:] if idx > 0 else text
 
 
+# Below this many blocks a process pool costs more to start than it saves
+PARALLEL_MIN_BLOCKS = 32
+
+
+def _chunksize(n_blocks, workers):
+    # ~4 chunks per worker keeps every core busy on mid-sized files; the cap of
+    # 64 bounds per-task pickling on big ones
+    return max(1, min(64, n_blocks // (workers * 4)))
+
+
+def _open_pool(n_blocks):
+    """
+    (pool, workers) for n_blocks of parsing, or (None, 1) when a pool would not pay
+    off (small inputs, single-CPU hosts) or cannot be created. Blocks parse
+    independently, so one pool serves every _map_blocks call of a parse.
+    """
+    workers = os.cpu_count() or 1
+    if n_blocks < PARALLEL_MIN_BLOCKS or workers <= 1:
+        return None, 1
+    # No more workers than chunks of work
+    workers = min(workers, -(-n_blocks // _chunksize(n_blocks, workers)))
+    try:
+        return ProcessPoolExecutor(max_workers=workers), workers
+    except (OSError, NotImplementedError):
+        return None, 1
+
+
+def _map_blocks(func, blocks, pool=None, workers=1):
+    """
+    func over blocks, in order, on pool when one is given. A pool that fails to
+    start or breaks falls back to running serially.
+    """
+    if pool is not None and blocks:
+        try:
+            return list(pool.map(func, blocks, chunksize=_chunksize(len(blocks), workers)))
+        except (OSError, BrokenProcessPool, pickle.PicklingError):
+            # The pool could not start or lost a worker; errors raised by func
+            # itself propagate unchanged instead of triggering a serial re-run
+            pass
+    return [func(b) for b in blocks]
+
+
 def parse_full_text(content):
     content = strip_cover_pages(content)
 
-    # Split by canonical TRIP # first
-    trip_blocks = TRIP_SPLIT.split(content)
+    # Split by canonical TRIP # first: block i runs from one TRIP # to the next.
+    # The viability test searches content in place with bounded find() calls rather
+    # than splitting first; each range is then sliced once, as a trip or prelim block.
+    starts = [m.start() for m in TRIP_START.finditer(content)]
     
-    parsed = []
+    eligible_blocks = []
     blocks_to_check_as_prelim = []
 
-    for b in trip_blocks:
-        if 'TRIP' in b and ('TAFB' in b or 'Credit Time' in b or 'PERDIEM' in b):
-            p = parse_trip_block(b)
-            if p: parsed.append(p)
+    find = content.find
+    for a, b in zip([0] + starts, starts + [len(content)]):
+        if a == b:
+            continue
+        # A range normally opens with its upper-case TRIP # header, so TRIP is an O(1)
+        # startswith; only the preamble and lower-case headers need the full find.
+        has_trip = content.startswith('TRIP', a) or find('TRIP', a, b) >= 0
+        if has_trip and (find('TAFB', a, b) >= 0 or find('Credit Time', a, b) >= 0
+                         or find('PERDIEM', a, b) >= 0):
+            eligible_blocks.append(content[a:b])
         else:
-            blocks_to_check_as_prelim.append(b)
+            blocks_to_check_as_prelim.append(content[a:b])
+
+    # Bid packs often repeat a trip verbatim, so each distinct block is parsed once
+    # per call. Repeats get their own deep copy: trips share no mutable state.
+    # (Not memoised across calls: the effective year depends on today's date.)
+    unique_blocks = list(dict.fromkeys(eligible_blocks))
 
     # Process prelims using the relaxed splitter
+    prelim_frags = []
     for b in blocks_to_check_as_prelim:
         # Re-split the fragment if it contains multiple prelims
         prelim_fragments = PRELIM_SPLIT.split(b)
         for frag in prelim_fragments:
-            if 'effective' in frag.lower() and ('TAFB' in frag or 'Credit Time' in frag or LEG_PATTERN.search(frag)):
-                p = parse_prelim_block(frag)
-                if p:
-                    is_duplicate = any(
-                        (item.get('trip_number') == p.get('trip_number') and item.get('pairing_number') == p.get('pairing_number'))
-                        for item in parsed
-                    )
-                    if not is_duplicate:
-                        parsed.append(p)
+            if 'effective' in frag.lower() and ('TAFB' in frag or 'Credit Time' in frag or _has_leg(frag)):
+                prelim_frags.append(frag)
+    # A repeated fragment parses to the same key and would be dropped by the dedupe
+    prelim_frags = list(dict.fromkeys(prelim_frags))
+
+    # One pool, sized for all of the work, serves both the trip and prelim maps
+    pool, workers = _open_pool(len(unique_blocks) + len(prelim_frags))
+    try:
+        trip_results = _map_blocks(parse_trip_block, unique_blocks, pool, workers)
+        prelim_results = _map_blocks(parse_prelim_block, prelim_frags, pool, workers)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    memo = dict(zip(unique_blocks, trip_results))
+    parsed = []
+    emitted = set()
+    for b in eligible_blocks:
+        trip = memo[b]
+        if not trip:
+            continue
+        if b in emitted:
+            trip = copy.deepcopy(trip)
+        emitted.add(b)
+        parsed.append(trip)
+
+    # (trip_number, pairing_number) of everything kept so far, for prelim dedupe
+    seen = {(t.get('trip_number'), t.get('pairing_number')) for t in parsed}
+
+    for p in prelim_results:
+        if p:
+            key = (p.get('trip_number'), p.get('pairing_number'))
+            if key not in seen:
+                seen.add(key)
+                parsed.append(p)
 
     return parsed
 
 
+def _decode_input(buf):
+    try:
+        return str(buf, 'utf-8')
+    except UnicodeDecodeError:
+        return str(buf, 'latin-1')
+
+
+def _dump_trip(trip):
+    """One trip as 2-space indented JSON bytes, via orjson unless it cannot encode it."""
+    try:
+        return orjson.dumps(trip, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    except orjson.JSONEncodeError:
+        # orjson rejects integers wider than 64 bits (e.g. a runaway TAFB or PERDIEM
+        # value); json encodes them. ensure_ascii=False keeps non-ASCII text as raw
+        # UTF-8, as orjson writes it, rather than \uXXXX escapes
+        return json.dumps(trip, indent=2, ensure_ascii=False).encode('utf-8')
+
+
 def main():
     if len(sys.argv) < 2:
         print(f"Usage: {sys.argv[0]} <pairing_file.txt>", file=sys.stderr)
@@ -530,12 +725,19 @@ def main():
         sys.exit(1)
         
     try:
-        try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                content = f.read()
-        except UnicodeDecodeError:
-            with open(filepath, 'r', encoding='latin-1') as f:
-                content = f.read()
+        # Regular files decode straight out of the page cache; the latin-1 fallback
+        # reuses the same mapping instead of reading the file a second time.
+        # Pipes, FIFOs and <(...) report size 0 and cannot be mapped, so read them.
+        with open(filepath, 'rb') as f:
+            st = os.fstat(f.fileno())
+            if stat.S_ISREG(st.st_mode) and st.st_size > 0:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    content = _decode_input(mm)
+            else:
+                content = _decode_input(f.read())
+        # Same newlines as the text-mode read this replaced
+        if '\r' in content:
+            content = content.replace('\r\n', '\n').replace('\r', '\n')
 
     except Exception as e:
         print(f"Error reading file: {e}", file=sys.stderr)
@@ -543,7 +745,24 @@ def main():
         
     try:
         parsed_data = parse_full_text(content)
-        print(json.dumps(parsed_data, indent=2))
+        if orjson is not None:
+            # One trip at a time, indented one level for its place in the list, so the
+            # whole document never sits in memory as one bytes object. JSON strings
+            # escape newlines, so every raw b'\n' is layout and safe to re-indent.
+            # Each trip is encoded before anything of it is written, so nothing is
+            # left half-written on stdout if encoding raises.
+            out = sys.stdout.buffer
+            sep = b'[\n  '
+            for trip in parsed_data:
+                chunk = _dump_trip(trip).replace(b'\n', b'\n  ')
+                out.write(sep)
+                out.write(chunk)
+                sep = b',\n  '
+            out.write(b'\n]\n' if parsed_data else b'[]\n')
+        else:
+            # Stream straight to stdout rather than building the whole document first
+            json.dump(parsed_data, sys.stdout, indent=2)
+            sys.stdout.write('\n')
     except Exception as e:
         print(f"Error during parsing: {e}", file=sys.stderr)
         sys.exit(1)
@@ -0,0 +1,668 @@
+#!/usr/bin/env python3
+"""
+Tests for pairing_parser.
+
+Most of the parser's hot paths were rewritten for speed. Each rewrite is checked
+against a straightforward reference that does the same job the way the original
+parser did, over fixed inputs; output changes made on purpose are pinned on their
+own. Run with `python -m unittest` (or pytest) from the repository root.
+"""
+import io
+import json
+import os
+import pickle
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, timedelta
+from unittest import mock
+
+import pairing_parser as pp
+
+HEADER = "TRIP #101 A1234 YEG  JUL 01 effective JUL 01 - JUL 31 [1 1 1 1 1 0 0]\n"
+
+
+# ---------------- First-occurrence fields ----------------
+
+FIRST_FIELD_BODIES = [
+    "RPT 06:00\nTAFB: 40h00 Credit Time: 12h30, PERDIEM: 123.45\nRLS 19:15\n",
+    # Repeats: only the first of each counts
+    "RPT 06:00 RPT 07:00\nTAFB: 1h00 TAFB: 2h00\nCredit Time: 3h00 Credit Time: 4h00\nRLS 10:00 RLS 11:00\n",
+    # Labels inside a leg line and a report time on the next line
+    "   1  WS1 YEG YYZ 08:00 09:00 1h00 RPT\n10:30 TAFB:\t9h59\n",
+    # TAFB, credit and per diem labels are case-insensitive; RPT and RLS are not
+    "tafb: 3h00 credit time: 2:30 perdiem: 1,234.50 rpt 06:00 rls 07:00\n",
+    # Per diem that does not parse as a number is kept as text
+    "PERDIEM: 1.2.3\nPERDIEM: 50\n",
+    "PERDIEM: abc\n",
+    "",
+]
+
+
+def ref_first_fields(block):
+    """The first-occurrence fields as one search per field over the whole block finds them."""
+    fields = {}
+    m = re.search(r"TAFB:\s*([\d+h\(\)\w:]+)", block, re.I)
+    if m:
+        fields['tafb'] = m.group(1).strip()
+    m = re.search(r"Credit Time:\s*([^\s,]+)", block, re.I)
+    if m:
+        fields['credit_time'] = m.group(1).strip()
+    m = re.search(r"PERDIEM:\s*([\d\.,]+)", block, re.I)
+    if m:
+        try:
+            fields['per_diem'] = float(m.group(1).replace(',', ''))
+        except ValueError:
+            fields['per_diem'] = m.group(1).strip()
+    m = re.search(r'RPT.*?(\d{2}:\d{2})', block)
+    if m:
+        fields['report_time'] = m.group(1)
+    m = re.search(r'RLS.*?(\d{2}:\d{2})', block)
+    if m:
+        fields['release_time'] = m.group(1)
+    return fields
+
+
+class FirstFieldsTest(unittest.TestCase):
+    """TAFB, credit, per diem, RPT and RLS come from their first occurrence."""
+
+    KEYS = ('tafb', 'credit_time', 'per_diem', 'report_time', 'release_time')
+
+    def test_first_occurrence(self):
+        for body in FIRST_FIELD_BODIES:
+            block = HEADER + body
+            trip = pp.parse_trip_block(block)
+            with self.subTest(body=body):
+                self.assertEqual({k: trip[k] for k in self.KEYS if k in trip}, ref_first_fields(block))
+
+    def test_repeated_labels_stay_linear(self):
+        # One search per field: 20,000 repeats of a label take milliseconds, where
+        # re-matching the label at every occurrence took seconds
+        for body in ('RPT ' * 20000 + '12:00', 'TAFB:' * 20000, 'Credit Time: ' * 20000):
+            start = time.perf_counter()
+            pp.parse_trip_block(HEADER + body)
+            self.assertLess(time.perf_counter() - start, 2.0, body[:20])
+
+
+# ---------------- Weekday-only flag ----------------
+
+class WeekdayOnlyTest(unittest.TestCase):
+
+    def test_across_year_end(self):
+        # Calendar cells in January belong to the following year; their weekday comes
+        # from the real date, not from the month and day re-read in the effective year
+        block = ("TRIP #7 B7 YEG  DEC 29 effective DEC 29 - JAN 4 [1 1 1 1 1 0 0]\n"
+                 "   1  WS1 YEG YYZ 08:00 11:30 3h30\n")
+        trip = pp.parse_trip_block(block)
+        dates = [date.fromisoformat(d) for d in trip['operating_dates']]
+        self.assertTrue(any(d.month == 1 for d in dates))
+        self.assertTrue(all(d.weekday() < 5 for d in dates))
+        self.assertTrue(trip['is_weekday_only'])
+
+    def test_weekend_day_of_work(self):
+        # A Friday start whose second day of work is a Saturday
+        block = ("TRIP #8 B8 YEG  JUL 03 effective JUL 03 - JUL 31 [0 0 0 0 1 0 0]\n"
+                 "   1  WS1 YEG YYZ 08:00 11:30 3h30\n ---- YYZ hotel 20h00\n"
+                 "   2  WS2 YYZ YEG 08:00 11:30 3h30\n")
+        trip = pp.parse_trip_block(block)
+        self.assertTrue(trip['calendar'])
+        self.assertTrue(all(cell.startswith('Sat') for cal in trip['calendar'] for k, cell in cal.items() if k == '2'))
+        self.assertFalse(trip['is_weekday_only'])
+
+
+# ---------------- Effective window ----------------
+
+WINDOW_CLAUSES = [
+    "YEG: 1111100 effective JUL 01 - JUL 31",
+    "[1 0 1 0 1 0 0] effective JUL 01 - AUG 15 except JUL 14 JUL 21 AUG 3",
+    "1_1_1__ effective DEC 20 - JAN 10",
+    "effective JUL 01 - JUL 31",
+    "[1 1] YEG: __11___ effective MAR 01 - MAR 31",
+    "[x y z] __1__11 effective FEB 20 - MAR 5",
+    "effective AUTO",
+    "Effective jul 1 - jul 9 except jul 4",
+    "YUL: 0000011 effective DEC 20 - JAN 10 except JAN 1 DEC 25 DEC 26",
+    "effective FEB 29 - MAR 3",
+    "effective JUL 1 -JUL 3 [0 0 0 0 0 1 1]",
+    "effective NOV 30 - FOO 2",
+]
+
+
+def window_block(clause, pad):
+    """A trip header whose effective clause follows pad characters of non-word
+    filler, so 'effective' sits at different distances from the block start."""
+    return "TRIP #101 A1234 YEG  JUL 01\n" + ". " * (pad // 2) + clause + "\n"
+
+
+def ref_operating_dates(block, effective_year):
+    """Operating dates from a copied +/-200 char window, walked one day at a time."""
+    eff_idx = block.lower().find('effective')
+    if eff_idx == -1:
+        return []
+    window = block[max(0, eff_idx - 200): eff_idx + 200]
+
+    m = pp.EFFECTIVE_NEIGHBOR.search(window)
+    if not m:
+        return []
+    start_mon, start_day, end_mon, end_day = m.group(1).upper(), m.group(2), m.group(3).upper(), m.group(4)
+    try:
+        start_date = datetime(effective_year, pp.MONTH_MAP[start_mon], int(start_day)).date()
+        end_date = datetime(effective_year, pp.MONTH_MAP[end_mon], int(end_day)).date()
+        if end_date < start_date:
+            end_date = datetime(effective_year + 1, pp.MONTH_MAP[end_mon], int(end_day)).date()
+    except Exception:
+        return []
+
+    mask_weekdays = None
+    bracket = pp.BRACKET_MASK.search(window)
+    if bracket:
+        mask_weekdays = pp._parse_bracket_mask(bracket.group(1))
+    if mask_weekdays is None:
+        mbase = pp.BASE_MASK.search(window)
+        if mbase:
+            mask_weekdays = pp._parse_underscore_digit_mask(mbase.group(1))
+    if mask_weekdays is None:
+        mnear = pp.NEAR_MASK.search(window)
+        if mnear:
+            mask_weekdays = pp._parse_underscore_digit_mask(mnear.group(1))
+    if mask_weekdays is None:
+        mask_weekdays = set(range(7))
+
+    exceptions = set()
+    ex_match = pp.EXCEPTIONS_RE.search(window)
+    if ex_match:
+        for mo, d in pp.MO_DAY.findall(ex_match.group(1)):
+            for year in (effective_year, effective_year + 1):
+                try:
+                    ex_date = datetime(year, pp.MONTH_MAP[mo.upper()], int(d)).date()
+                except Exception:
+                    continue
+                if start_date <= ex_date <= end_date:
+                    exceptions.add(ex_date)
+
+    res = []
+    cur = start_date
+    while cur <= end_date:
+        if cur.weekday() in mask_weekdays and cur not in exceptions:
+            res.append(cur)
+        cur += timedelta(days=1)
+    return res
+
+
+class EffectiveWindowTest(unittest.TestCase):
+    """Searching the 'effective' window in place gives the copied window's dates."""
+
+    def test_operating_dates(self):
+        for clause in WINDOW_CLAUSES:
+            for pad in (0, 150, 400):
+                block = window_block(clause, pad)
+                for year in (2024, 2026):
+                    with self.subTest(clause=clause, pad=pad, year=year):
+                        self.assertEqual(pp.parse_operating_dates(block, year), ref_operating_dates(block, year))
+
+    def test_mask_outside_window(self):
+        # The base mask is more than 200 characters before 'effective', so it is ignored
+        block = "YEG: _____11" + " " * 250 + "effective JUL 06 - JUL 12"
+        self.assertEqual(len(pp.parse_operating_dates(block, 2026)), 7)
+        self.assertEqual(pp.parse_operating_dates(block, 2026), ref_operating_dates(block, 2026))
+
+    def test_window_edge_is_not_a_word_boundary(self):
+        # Intended change. The window starts at the 'Y' of 'XYEG:'. A copied window
+        # would see the start of 'YEG:' as a word boundary and read a weekend-only base
+        # mask; searched in place, 'XYEG:' is one word, so no mask applies and every
+        # day operates.
+        block = "." * 99 + "XYEG: _____11 ." + " " * 186 + "effective JUL 06 - JUL 12"
+        self.assertEqual(block.find('effective'), 300)
+        self.assertEqual(len(pp.parse_operating_dates(block, 2026)), 7)
+        self.assertEqual(len(ref_operating_dates(block, 2026)), 2)
+
+
+# ---------------- Leg anchor gating ----------------
+
+LEG_BODIES = [
+    # Ordinary days, deadheads and a LIM9 leg
+    "   1  AC101 YEG YYZ 08:00 11:30 3h30\n   1  WS202 YYZ YUL 13:00 14:20 1h20\n"
+    "   2  DH303 YUL YEG 09:00 11:45 4:45\n   3  LIM9123 YEG YLW 07:10 08:25 1h15\n",
+    # Two legs on one line and a leg straight after a report time
+    "RPT 06:15  1  WS10 YEG YVR 07:00 07:30 1h30  1  WS11 YVR YEG 08:30 11:00 1h30\n",
+    # Anchors that are not legs: prose, a short flight field, a missing block time
+    "Day 1 AC hotel nearby\n 2 AB YEG YYZ\n   4  WS99 YEG YYZ 08:00 11:30\n 12 X YEG YYZ 08:00 09:00 1h00\n",
+    # Wide whitespace runs and non-ASCII spaces between fields
+    "\t\t 7 \t WS400\tYEG\t\tYYZ 21:55 02:10 4H15\n 8\u00a0WS401\u2003YYZ\u00a0YEG 08:00 10:30 4h30\n",
+    # Legs inside a layover line and a leg overlapping a TAFB token
+    " ---- YYZ hotel 1  WS500 YYZ YEG 10:00 12:00 2h00 14h20\nTAFB: 1  WS501 YEG YYZ 10:00 12:00 2:00\n",
+    # Day numbers out of order and repeated
+    "   2  WS1 YEG YYZ 08:00 09:00 1h00\n   1  WS2 YYZ YEG 10:00 11:00 1h00\n   2  WS3 YEG YUL 12:00 13:00 1h00\n",
+    # Nothing but noise
+    "no legs here 12:00 13:00\n",
+]
+
+
+def generated_blocks(n, seed=1650):
+    """n deterministic blocks mixing legs, cues, times and line breaks."""
+    rng = random.Random(seed)
+    pieces = [
+        'hotel', 'Overnight', 'LAYOVER', 'YYZ', '---- YUL', '14h20', '9h05', 'RPT 07:00', 'RLS 18:30',
+        'TAFB: 40h00', ' 2  AC123 YEG YYZ 08:00 11:30 3h30', ' 3  WS9 YYZ YEG 23:10 01:40 4:30',
+        ' 1  lim9 yeg yyz 08:00 09:00 1h00', '12', 'xx', '\n', '\n', '\r', '\v', '\x85', '\u2028',
+        ' ', '  ', '\t',
+    ]
+    return [
+        HEADER + "".join(rng.choice(pieces) + rng.choice(('', ' ')) for _ in range(rng.randint(0, 40)))
+        for _ in range(n)
+    ]
+
+
+def ref_days(block):
+    """Legs by day number, as LEG_PATTERN.finditer() over the whole block sees them."""
+    days = {}
+    for lm in pp.LEG_PATTERN.finditer(block):
+        day, flight, dep, arr, dep_t, arr_t, blk = lm.groups()
+        days.setdefault(int(day), []).append((flight, dep, arr, dep_t, arr_t, blk))
+    return days
+
+
+def scanned_days(trip):
+    return {
+        day: [(leg['original_flight_number'], leg['dep_station'], leg['arr_station'],
+               leg['dep_time'], leg['arr_time'], leg['duration']) for leg in legs]
+        for day, legs in trip['days'].items()
+    }
+
+
+class LegAnchorGatingTest(unittest.TestCase):
+    """Legs found at LEG_ANCHOR hits are exactly those LEG_PATTERN.finditer() finds."""
+
+    def test_trip_block_legs(self):
+        for body in LEG_BODIES:
+            block = HEADER + body
+            with self.subTest(body=body[:40]):
+                self.assertEqual(scanned_days(pp.parse_trip_block(block)), ref_days(block))
+
+    def test_generated_blocks(self):
+        for block in generated_blocks(300):
+            self.assertEqual(scanned_days(pp.parse_trip_block(block)), ref_days(block), block)
+
+    def test_has_leg(self):
+        for text in LEG_BODIES + generated_blocks(100, seed=7):
+            self.assertEqual(pp._has_leg(text), bool(pp.LEG_PATTERN.search(text)), text)
+
+
+# ---------------- Trip encoding ----------------
+
+@unittest.skipIf(pp.orjson is None, "orjson is not installed")
+class DumpTripTest(unittest.TestCase):
+
+    def test_integers_wider_than_64_bits(self):
+        for line in ("TAFB: 99999999999999999999h00", "PERDIEM: 12345678901234567890123"):
+            trip = pp.parse_trip_block(HEADER + line + "\n")
+            self.assertEqual(json.loads(pp._dump_trip(trip)), json.loads(json.dumps(trip)))
+
+    def test_fallback_keeps_non_ascii_raw(self):
+        # orjson writes non-ASCII text as raw UTF-8; the json fallback must too
+        trip = pp.parse_trip_block(HEADER + "   1  WS1 YEG YYZ 08:00 11:30 3h30\nTAFB: 40h00caf\u00e9\n")
+        encoded = pp._dump_trip(trip)
+        self.assertIn('caf\u00e9'.encode('utf-8'), encoded)
+        self.assertEqual(encoded, json.dumps(trip, indent=2, ensure_ascii=False).encode('utf-8'))
+
+        trip = pp.parse_trip_block(HEADER + "TAFB: 99999999999999999999h00caf\u00e9\n")
+        with self.assertRaises(pp.orjson.JSONEncodeError):
+            pp.orjson.dumps(trip)
+        encoded = pp._dump_trip(trip)
+        self.assertIn('caf\u00e9'.encode('utf-8'), encoded)
+        self.assertEqual(json.loads(encoded), json.loads(json.dumps(trip)))
+
+
+# ---------------- Day keys ----------------
+
+class DayKeysTest(unittest.TestCase):
+
+    def test_day_keys_are_ints(self):
+        # Intended change. '01' and '1' are the same day number, so their legs share one key
+        block = HEADER + "  01  WS1 YEG YYZ 08:00 09:00 1h00\n   1  WS2 YYZ YEG 10:00 11:00 1h00\n"
+        trip = pp.parse_trip_block(block)
+        self.assertEqual(list(trip['days']), [1])
+        self.assertEqual([leg['flight_number'] for leg in trip['days'][1]], ['WS1', 'WS2'])
+        self.assertEqual(trip['calendar'][0].keys(), {'1'})
+
+    def test_json_keys_are_strings(self):
+        trip = pp.parse_trip_block(HEADER + "   2  WS1 YEG YYZ 08:00 09:00 1h00\n")
+        self.assertEqual(list(json.loads(json.dumps(trip))['days']), ['2'])
+
+
+# ---------------- Process pool ----------------
+
+def pairing_text(n, seed=1650):
+    """A bid pack of n trips (some repeated verbatim) and two preliminary pairings."""
+    rng = random.Random(seed)
+    trips = []
+    for i in range(n):
+        legs = "".join(
+            f"   {day}  WS{rng.randint(1, 999)} YEG YYZ 0{rng.randint(6, 9)}:00 11:30 3h30\n"
+            for day in range(1, rng.randint(2, 4))
+        )
+        trips.append(f"TRIP #{100 + i} A{1000 + i} YEG  JUL 01 effective JUL 01 - JUL 31 "
+                     f"[1 1 1 1 1 0 0]\nRPT 06:00\n{legs} ---- YYZ hotel 14h20\n"
+                     f"TAFB: {rng.randint(20, 60)}h00 Credit Time: 12h30\n")
+    trips += trips[:3]
+    prelims = ("Preliminary P900 YEG effective JUL 01 - JUL 10\n   1  WS7 YEG YVR 07:00 09:00 2h00\n"
+               "Preliminary P901 YEG effective AUG 01 - AUG 10\n   1  WS8 YVR YEG 07:00 09:00 2h00\n")
+    return prelims + "".join(trips)
+
+
+class ProcessPoolTest(unittest.TestCase):
+
+    def serial(self, text):
+        with mock.patch.object(pp, 'PARALLEL_MIN_BLOCKS', 10 ** 9):
+            return pp.parse_full_text(text)
+
+    def test_pool_matches_serial(self):
+        text = pairing_text(40)
+        opened = []
+
+        def open_pool(n_blocks):
+            pool, workers = real_open_pool(n_blocks)
+            opened.append(pool)
+            return pool, workers
+
+        real_open_pool = pp._open_pool
+        # Force a real pool even on a single-CPU host
+        with mock.patch.object(pp.os, 'cpu_count', return_value=4), \
+                mock.patch.object(pp, '_open_pool', open_pool):
+            pooled = pp.parse_full_text(text)
+        self.assertEqual(len(opened), 1)
+        self.assertIsNotNone(opened[0])
+        self.assertEqual(len(pooled), 45)
+        self.assertEqual(pooled, self.serial(text))
+
+    def test_pool_that_cannot_start(self):
+        text = pairing_text(40)
+        with mock.patch.object(pp.os, 'cpu_count', return_value=4), \
+                mock.patch.object(pp, 'ProcessPoolExecutor', side_effect=OSError("no semaphores")):
+            self.assertEqual(pp._open_pool(40), (None, 1))
+            self.assertEqual(pp.parse_full_text(text), self.serial(text))
+
+    def test_broken_pool_falls_back_to_serial(self):
+        blocks = ['a', 'bb', 'ccc']
+        for error in (OSError("fork failed"), BrokenProcessPool("worker died"),
+                      pickle.PicklingError("cannot pickle")):
+            pool = mock.Mock()
+            pool.map.side_effect = error
+            with self.subTest(error=type(error).__name__):
+                self.assertEqual(pp._map_blocks(len, blocks, pool, 2), [1, 2, 3])
+                pool.map.assert_called_once()
+
+    def test_func_errors_propagate(self):
+        # An exception raised by func in a worker is re-raised, not retried serially
+        pool = mock.Mock()
+        pool.map.side_effect = ValueError("bad block")
+        func = mock.Mock()
+        with self.assertRaises(ValueError):
+            pp._map_blocks(func, ['a'], pool, 2)
+        func.assert_not_called()
+
+
+# ---------------- Reading the input file ----------------
+
+def ref_content(data):
+    """The text the original main() read: text mode, UTF-8 then latin-1, universal newlines."""
+    try:
+        return io.TextIOWrapper(io.BytesIO(data), encoding='utf-8').read()
+    except UnicodeDecodeError:
+        return io.TextIOWrapper(io.BytesIO(data), encoding='latin-1').read()
+
+
+def run_main(path):
+    """main()'s stdout for path, as bytes."""
+    stdout = io.TextIOWrapper(io.BytesIO(), encoding='utf-8')
+    with mock.patch.object(sys, 'argv', ['pairing_parser.py', path]), \
+            mock.patch.object(sys, 'stdout', stdout):
+        pp.main()
+        stdout.flush()
+        return stdout.buffer.getvalue()
+
+
+def write_in_thread(target, data):
+    """Write data to a FIFO path or a pipe's write fd from another thread, so a full
+    pipe cannot block, and close it so the reader sees end of file."""
+    def write():
+        with open(target, 'wb') as f:
+            f.write(data)
+    thread = threading.Thread(target=write)
+    thread.start()
+    return thread
+
+
+class ReadInputTest(unittest.TestCase):
+    """main() reads regular files, pipes and FIFOs into the text the original read."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        pack = pairing_text(5)
+        self.inputs = {
+            'lf': pack.encode('utf-8'),
+            'crlf': pack.replace('\n', '\r\n').encode('utf-8'),
+            'cr': pack.replace('\n', '\r').encode('utf-8'),
+            'latin-1': pack.replace('hotel', 'h\u00f4tel caf\u00e9').encode('latin-1'),
+            # Bigger than a pipe buffer
+            'large': pairing_text(300).encode('utf-8'),
+        }
+
+    def assert_output(self, out, data):
+        self.assertEqual(json.loads(out), json.loads(json.dumps(pp.parse_full_text(ref_content(data)))))
+
+    def test_regular_file(self):
+        for name, data in self.inputs.items():
+            path = os.path.join(self.tmp.name, name + '.txt')
+            with open(path, 'wb') as f:
+                f.write(data)
+            with self.subTest(input=name):
+                self.assert_output(run_main(path), data)
+
+    def test_empty_file(self):
+        path = os.path.join(self.tmp.name, 'empty.txt')
+        open(path, 'wb').close()
+        self.assertEqual(run_main(path), b'[]\n')
+
+    def test_pipe(self):
+        for name, data in self.inputs.items():
+            r, w = os.pipe()
+            with self.subTest(input=name):
+                thread = write_in_thread(w, data)
+                try:
+                    out = run_main(f'/dev/fd/{r}')
+                finally:
+                    thread.join()
+                    os.close(r)
+                self.assert_output(out, data)
+
+    @unittest.skipUnless(hasattr(os, 'mkfifo'), "no FIFOs on this platform")
+    def test_fifo(self):
+        for name, data in self.inputs.items():
+            path = os.path.join(self.tmp.name, name + '.fifo')
+            os.mkfifo(path)
+            with self.subTest(input=name):
+                thread = write_in_thread(path, data)
+                try:
+                    out = run_main(path)
+                finally:
+                    thread.join()
+                self.assert_output(out, data)
+
+
+# ---------------- Layover durations ----------------
+
+class LayoverDurationTest(unittest.TestCase):
+
+    def test_layovers_carry_duration_minutes(self):
+        trip = pp.parse_trip_block(HEADER + " ---- YYZ hotel 14h20\n")
+        self.assertEqual(trip['layovers'], [{"location": "YYZ", "duration": "14h20", "duration_minutes": 860}])
+        self.assertEqual(trip['longest_layover'], 14.33)
+
+    def test_no_duration(self):
+        trip = pp.parse_trip_block(HEADER + " ---- YUL overnight\n")
+        self.assertEqual(trip['layovers'], [{"location": "YUL", "duration": "N/A"}])
+
+
+# ---------------- Layover cue lines ----------------
+
+LAYOVER_BODIES = [
+    " ---- YYZ Hotel Marriott 14h20\n ---- YUL overnight\n",
+    "layover in YVR 9h05\nlayover YVR 7h59\nLAYOVER YYC\nhotel without a station 10h00\n",
+    # Several cues on one line, and cues on consecutive lines
+    "hotel hotel overnight ---- YHZ layover 22h10\nhotel YQR 11h00 overnight\nhotel\n",
+    # Every character str.splitlines() breaks on
+    "hotel YYZ 9h00\rhotel YUL 9h01\vhotel YOW 9h02\fhotel YQB 9h03\x1chotel YQM 9h04\x1d"
+    "hotel YSJ 9h05\x1ehotel YFC 9h06\x85hotel YQX 9h07\u2028hotel YYT 9h08\u2029hotel YHZ 9h09",
+    # Cue words as parts of other words do not count
+    "hotels YYZ 9h00\nlayovers YUL 9h00\nmotel YOW 9h00\n",
+    # Cue lines that also hold report, release and leg tokens
+    "RPT 12:30 hotel YYZ 10h00  1  WS1 YEG YYZ 13:00 16:30 3h30 RLS 21:00\n",
+    # A cue right at the end of the block, with trailing spaces
+    "   1  WS1 YEG YYZ 08:00 11:30 3h30\n ---- YYZ hotel   ",
+    # Many cues on a single long line
+    "hotel " * 500 + "---- YEG 12h00\n",
+]
+
+
+def ref_layovers(block):
+    """Layovers from a line-by-line walk of block.splitlines()."""
+    layovers = []
+    for raw in block.splitlines():
+        line = raw.rstrip()
+        if not pp.LAYOVER_CUE.search(line):
+            continue
+        lmkr = pp.LAYOVER_MARKER.search(line)
+        dmatch = pp.LAYOVER_DUR.search(line)
+        if lmkr:
+            layover = {"location": lmkr.group(1).upper(), "duration": dmatch.group(1) if dmatch else "N/A"}
+            if dmatch:
+                layover["duration_minutes"] = pp.time_str_to_minutes(dmatch.group(1))
+            layovers.append(layover)
+            continue
+        apt = re.search(r'\b([A-Z]{3})\b', line)
+        if not apt:
+            continue
+        if dmatch:
+            mins = pp.time_str_to_minutes(dmatch.group(1))
+            if mins >= 8*60:
+                layovers.append({"location": apt.group(1), "duration": dmatch.group(1), "duration_minutes": mins})
+        else:
+            layovers.append({"location": apt.group(1), "duration": "N/A"})
+    return layovers
+
+
+class LayoverCueLineTest(unittest.TestCase):
+    """Cue words widened to their line inside the token scan give the splitlines() layovers."""
+
+    def test_trip_block_layovers(self):
+        for body in LAYOVER_BODIES + LEG_BODIES:
+            block = HEADER + body
+            with self.subTest(body=body[:40]):
+                self.assertEqual(pp.parse_trip_block(block)['layovers'], ref_layovers(block))
+
+    def test_generated_blocks(self):
+        for block in generated_blocks(300):
+            self.assertEqual(pp.parse_trip_block(block)['layovers'], ref_layovers(block), block)
+
+    def test_legs_on_cue_lines(self):
+        for body in LAYOVER_BODIES:
+            block = HEADER + body
+            with self.subTest(body=body[:40]):
+                self.assertEqual(scanned_days(pp.parse_trip_block(block)), ref_days(block))
+
+    def test_many_cues_on_one_line_stay_linear(self):
+        # Each cue line is widened once; re-scanning the line at every cue took seconds
+        start = time.perf_counter()
+        trip = pp.parse_trip_block(HEADER + "hotel " * 8000 + "---- YEG 12h00\n")
+        self.assertLess(time.perf_counter() - start, 2.0)
+        self.assertEqual(len(trip['layovers']), 1)
+
+
+# ---------------- Leg case ----------------
+
+class LegCaseTest(unittest.TestCase):
+
+    def test_lower_case_legs_are_not_matched(self):
+        # Intended change. Flight numbers and stations are upper case in bid packs
+        block = HEADER + "   1  ws1 yeg yyz 08:00 09:00 1h00\n   2  WS2 yeg YYZ 08:00 09:00 1h00\n"
+        self.assertEqual(pp.parse_trip_block(block)['days'], {})
+        self.assertFalse(pp._has_leg(block))
+
+    def test_upper_case_legs_in_case_insensitive_text(self):
+        # The token scan is case-insensitive for its labels but not for legs
+        block = HEADER + "tafb: 3h00\n   1  WS1 YEG YYZ 08:00 09:00 1h00\n"
+        self.assertEqual(list(pp.parse_trip_block(block)['days']), [1])
+
+
+# ---------------- Cached date expansion ----------------
+
+class ExpandDatesCacheTest(unittest.TestCase):
+    """_expand_dates is memoised; callers get their own list, never the cached tuple."""
+
+    def test_mutating_operating_dates(self):
+        block = "TRIP #9 B9 YEG  JUL 01 effective JUL 01 - JUL 31 [1 1 1 1 1 0 0] except JUL 14\n"
+        first = pp.parse_operating_dates(block, 2026)
+        expected = list(first)
+        first.clear()
+        second = pp.parse_operating_dates(block, 2026)
+        self.assertEqual(second, expected)
+        second.reverse()
+        second.append(date(2026, 12, 25))
+        self.assertEqual(pp.parse_operating_dates(block, 2026), expected)
+
+    def test_mutating_a_parsed_trip(self):
+        block = HEADER + "   1  WS1 YEG YYZ 08:00 09:00 1h00\n"
+        trip = pp.parse_trip_block(block)
+        expected = list(trip['operating_dates'])
+        self.assertTrue(expected)
+        trip['operating_dates'].clear()
+        self.assertEqual(pp.parse_trip_block(block)['operating_dates'], expected)
+
+
+# ---------------- Streamed output ----------------
+
+class StreamedOutputTest(unittest.TestCase):
+    """main() writes the document json.dumps(parsed, indent=2) would, one trip at a time."""
+
+    INPUTS = {
+        'empty': "",
+        'no trips': "cover page only\n",
+        'single trip': HEADER + "   1  WS1 YEG YYZ 08:00 11:30 3h30\nTAFB: 3h30 caf\u00e9\n",
+        'many trips': pairing_text(6),
+        # orjson cannot encode this trip, so it goes through the json fallback mid-stream
+        'wide integer': pairing_text(3) + HEADER.replace('#101', '#999') + "TAFB: 99999999999999999999h00\n",
+    }
+
+    def run_inputs(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for name, text in self.INPUTS.items():
+                path = os.path.join(tmp, 'pack.txt')
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(text)
+                parsed = pp.parse_full_text(text)
+                with self.subTest(input=name):
+                    out = run_main(path)
+                    self.assertEqual(json.loads(out), json.loads(json.dumps(parsed)))
+                    yield name, parsed, out
+
+    @unittest.skipIf(pp.orjson is None, "orjson is not installed")
+    def test_orjson_stream(self):
+        for name, parsed, out in self.run_inputs():
+            self.assertEqual(out, (json.dumps(parsed, indent=2, ensure_ascii=False) + '\n').encode('utf-8'))
+        self.assertEqual(len(pp.parse_full_text(self.INPUTS['single trip'])), 1)
+
+    def test_json_stream(self):
+        with mock.patch.object(pp, 'orjson', None):
+            for name, parsed, out in self.run_inputs():
+                self.assertEqual(out, (json.dumps(parsed, indent=2) + '\n').encode('utf-8'))
+
+
+if __name__ == "__main__":
+    unittest.main()